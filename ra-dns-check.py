@@ -7,31 +7,35 @@
 # Please see the file LICENSE for the license.
 
 import argparse,argcomplete
-# need ast to more safely parse config file
-import ast
+import calendar
 import configparser
+# to cache results fetched from the RIPE Atlas API
+import gzip
+import hashlib
 import json
 import logging
-import mmap
+import math
+# orjson reads and writes the (large) cached RIPE Atlas results much
+# faster than the json module, but we can do without it.
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import os
+# to save and load the probe properties cache
+import pickle
 import re
-import statistics
 import sys
+import threading
 import time
-from datetime import datetime
-# to decompress RIPE Atlas probe data file
-import bz2
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+from datetime import datetime, timezone
 import base64
-# needed to fetch the probe properties file from RIPE
-import urllib.request
-# These RIPE python modules are usually installed with pip:
-from ripe.atlas.cousteau import AtlasLatestRequest
-from ripe.atlas.cousteau import AtlasResultsRequest
-from ripe.atlas.cousteau import Probe
-from ripe.atlas.sagan import DnsResult
-from ripe.atlas.cousteau import Measurement
-# for debugging
-from pprint import pprint
+# The RIPE python modules (usually installed with pip), and the modules
+# needed to fetch and read RIPE's probe properties file, are imported in
+# the functions that use them, so they aren't loaded (which takes a while)
+# unless they are needed.
 #
 # Valid log levels
 valid_log_levels = ['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL']
@@ -124,21 +128,25 @@ options_sample_dict = {
         'help': ' Wikipedia says 2010 was when RIPE Atlas was established, so we use that\n; as a starting point for when it might contain some data.',
         'type': 'string'},
     'probe_properties_to_report': {
-        'default': reportable_probe_properties,
-        'help': 'The list of probe properties to report. Must be a subset of:\n;  ' + str(reportable_probe_properties),
+        'default': json.dumps(reportable_probe_properties),
+        'help': 'The list of probe properties to report (as a JSON list). Must be a subset of:\n;  ' + json.dumps(reportable_probe_properties),
         'type': 'string'},
     'ripe_atlas_probe_properties_raw_file': {
         'default': os.environ['HOME'] + '/.RIPE_atlas_all_probe_properties.bz2',
         'help': 'There are a couple of files used to locally cache probe data, the first comes directly from RIPE:',
         'type': 'string'},
     'ripe_atlas_probe_properties_json_cache_file': {
-        'default': os.environ['HOME'] + '/.RIPE_atlas_probe_properties_cache_file.json',
-        'help': 'The second cache file we generate, based upon probe info we request (one at a time) from the RIPE Atlas API.',
+        'default': os.environ['HOME'] + '/.RIPE_atlas_probe_properties_cache_file.pickle',
+        'help': 'The second cache file we generate (a python pickle), based upon probe info we request (one at a time) from the RIPE Atlas API.  (Older versions saved it as JSON; if this name ends in .json, that file is read in once, and the pickle is saved next to it, ending in .pickle.)',
         'type': 'string'},
     'ripe_atlas_current_probe_properties_url': {
         'default': 'https://ftp.ripe.net/ripe/atlas/probes/archive/meta-latest',
         'help': 'Where to fetch the RA probe properties file from.',
         'type': 'string'},
+    'ripe_atlas_results_cache_dir': {
+        'default': os.environ['HOME'] + '/.RIPE_atlas_results_cache',
+        'help': 'Directory to cache measurement results fetched from the RIPE Atlas API in.',
+        'type': 'string'},
     'split_char': {
         'default': '.',
         'help': 'character (delimiter) to split the string on (can occur in the string more than once.',
@@ -191,6 +199,18 @@ options_sample_dict = {
         'default': 86400,
         'help': 'The max age (seconds) of the RIPE Atlas probe info file (older than this and we download a new one). Default: 86400',
         'type': 'integer'},
+    'latest_results_cache_max_age': {
+        'default': 0,
+        'help': 'The max age (seconds) of cached "latest" results from the RIPE Atlas API (0 means they are not cached; they never are with --scrape). Default: 0',
+        'type': 'integer'},
+    'results_cache_max_age': {
+        'default': 604800,
+        'help': 'The max age (seconds) of cached results for time periods that are over (older ones are removed from ripe_atlas_results_cache_dir). Default: 604800',
+        'type': 'integer'},
+    'measurement_info_cache_max_age': {
+        'default': 604800,
+        'help': 'The max age (seconds) of the cached interval and address family of a RIPE Atlas measurement. Default: 604800',
+        'type': 'integer'},
     'scrape': {
         'default': False,
         'help': 'Scrape output for Prometheus',
@@ -222,16 +242,19 @@ options_sample_dict = {
 
 }
 
-sample_config_string = sample_config_string_header
-expected_config_items = options_sample_dict.keys()
-# Iterate over the items in the options_sample_dict (defined above)
-# and shove them into the big string "sample_config_dict" that will then be fed to ConfigParser.
-for k in expected_config_items:
-    sample_config_string += (';\n')
-    sample_config_string += ('; ' + options_sample_dict[k]['help'] + '\n')
-    sample_config_string += (k + ' = ' + str(options_sample_dict[k]['default']) + '\n')
+# (A frozenset, as it is only used for membership tests and set arithmetic.)
+expected_config_items = frozenset(options_sample_dict)
 
-logging.debug(sample_config_string)
+# Build config file text: iterate over the items in the
+# options_sample_dict (defined above) and shove them, with the supplied
+# values, into one big string.  This is only needed when there's no
+# (usable) config file to read, or one needs to be written, so it is not
+# done unless then.  (Joining the pieces once is much cheaper than growing
+# the string piece by piece.)
+def build_config_string(option_values):
+    return sample_config_string_header + ''.join(
+        ';\n; %s\n%s = %s\n' % (options_sample_dict[k]['help'], k, option_values[k])
+        for k in options_sample_dict)
 
 #
 #
@@ -265,50 +288,64 @@ parser = argparse.ArgumentParser(description='Display statistics from RIPE Atlas
 # Compare one measurement's (12016241) for two points in time: 20210101_0000 and 20210301_0000.
 %(prog)s --datetime1 20210101_0000 --datetime2 20210301_0000 12016241
 ''')
-parser.add_argument('--datetime1', '--dt1', help=options_sample_dict['datetime1']['help'], type=str, default=options_sample_dict['datetime1']['default'])
-parser.add_argument('--datetime2', '--dt2', help=options_sample_dict['datetime2']['help'], type=str, default=options_sample_dict['datetime2']['default'])
-parser.add_argument('-a', '--all_probes', help=options_sample_dict['all_probes']['help'], action='store_true', default=options_sample_dict['all_probes']['default'])
-parser.add_argument('-c', '--color', '--colour', help=options_sample_dict['color']['help'], action="store_true", default=options_sample_dict['color']['default'])
-parser.add_argument('-C', '--no_color', '--no_colour', help=options_sample_dict['no_color']['help'], action="store_true", default=options_sample_dict['no_color']['default'])
-parser.add_argument('-e', '--emphasis_chars', help=options_sample_dict['emphasis_chars']['help'], action="store_true", default=options_sample_dict['emphasis_chars']['default'])
-parser.add_argument('-E', '--exclusion_list_file', help=options_sample_dict['exclusion_list_file']['help'], type=str, default=options_sample_dict['exclusion_list_file']['default'])
+
+# Each option in options_sample_dict gets its help text and default from
+# there.  (Its key is the name of its --long option.)
+def add_option_argument(*flags, **kwargs):
+    option = next(flag[2:] for flag in flags if flag.startswith('--'))
+    option_sample = options_sample_dict[option]
+    parser.add_argument(*flags, help=option_sample['help'], default=option_sample['default'], **kwargs)
+
+add_option_argument('--datetime1', '--dt1', type=str)
+add_option_argument('--datetime2', '--dt2', type=str)
+add_option_argument('-a', '--all_probes', action='store_true')
+add_option_argument('-c', '--color', '--colour', action="store_true")
+add_option_argument('-C', '--no_color', '--no_colour', action="store_true")
+add_option_argument('-e', '--emphasis_chars', action="store_true")
+add_option_argument('-E', '--exclusion_list_file', type=str)
 parser.add_argument('-f', '--config_file', help='Read (and write) the config from specified file', type=str, default=my_config_file)
-parser.add_argument('-H', '--no_header', help=options_sample_dict['no_header']['help'], action="store_true", default=options_sample_dict['no_header']['default'])
-parser.add_argument('-i', '--dns_response_item_occurence_to_return', help=options_sample_dict['dns_response_item_occurence_to_return']['help'], type=int, default=options_sample_dict['dns_response_item_occurence_to_return']['default'])
-parser.add_argument('-l', '--latency_diff_threshold', help=options_sample_dict['latency_diff_threshold']['help'], type=int, default=options_sample_dict['latency_diff_threshold']['default'])
-parser.add_argument('--log_level', help=options_sample_dict['log_level']['help'], type=str, choices=valid_log_levels, default=options_sample_dict['log_level']['default'])
-parser.add_argument('--oldest_atlas_result_datetime', help=options_sample_dict['oldest_atlas_result_datetime']['help'], type=str, default=options_sample_dict['oldest_atlas_result_datetime']['default'])
-parser.add_argument('-P', '--do_not_list_probes', help=options_sample_dict['do_not_list_probes']['help'], action='store_true', default=options_sample_dict['do_not_list_probes']['default'])
-parser.add_argument('--probe_properties_to_report', help=options_sample_dict['probe_properties_to_report']['help'], type=str, default=options_sample_dict['probe_properties_to_report']['default'])
-parser.add_argument('-r', '--raw_probe_properties_file_max_age', help=options_sample_dict['raw_probe_properties_file_max_age']['help'], type=int, default=options_sample_dict['raw_probe_properties_file_max_age']['default'])
-parser.add_argument('--ripe_atlas_current_probe_properties_url', help=options_sample_dict['ripe_atlas_current_probe_properties_url']['help'], type=str, default=options_sample_dict['ripe_atlas_current_probe_properties_url']['default'])
-parser.add_argument('--ripe_atlas_probe_properties_json_cache_file', help=options_sample_dict['ripe_atlas_probe_properties_json_cache_file']['help'], type=str, default=options_sample_dict['ripe_atlas_probe_properties_json_cache_file']['default'])
-parser.add_argument('--ripe_atlas_probe_properties_raw_file', help=options_sample_dict['ripe_atlas_probe_properties_raw_file']['help'], type=str, default=options_sample_dict['ripe_atlas_probe_properties_raw_file']['default'])
-parser.add_argument('-s', '--list_slow_probes_only', help=options_sample_dict['list_slow_probes_only']['help'], action='store_true', default=options_sample_dict['list_slow_probes_only']['default'])
-parser.add_argument('-S', '--slow_threshold', help=options_sample_dict['slow_threshold']['help'], type=int, default=options_sample_dict['slow_threshold']['default'])
-parser.add_argument('-t', '--split_char', help=options_sample_dict['split_char']['help'], type=str, default=options_sample_dict['split_char']['default'])
-parser.add_argument('-u', '--print_summary_stats', help=options_sample_dict['print_summary_stats']['help'], action='store_true', default=options_sample_dict['print_summary_stats']['default'])
-parser.add_argument('--scrape', help=options_sample_dict['scrape']['help'], action='store_true', default=options_sample_dict['scrape']['default'])
-parser.add_argument('--include_probe_timestamp', help=options_sample_dict['include_probe_timestamp']['help'], action='store_true', default=options_sample_dict['include_probe_timestamp']['default'])
-parser.add_argument('--autocomplete', help=options_sample_dict['autocomplete']['help'], action='store_true', default=options_sample_dict['autocomplete']['default'])
-parser.add_argument('--probes', help=options_sample_dict['probes']['help'], type=str, default=options_sample_dict['probes']['default'])
-parser.add_argument('--id_servermethod', help=options_sample_dict['id_servermethod']['help'], type=str, choices=valid_id_server_method, default=options_sample_dict['id_servermethod']['default'])
-parser.add_argument('--scrape_staleness_seconds', help=options_sample_dict['scrape_staleness_seconds']['help'], type=int, default=options_sample_dict['scrape_staleness_seconds']['default'])
+add_option_argument('-H', '--no_header', action="store_true")
+add_option_argument('-i', '--dns_response_item_occurence_to_return', type=int)
+add_option_argument('-l', '--latency_diff_threshold', type=int)
+add_option_argument('--latest_results_cache_max_age', type=int)
+add_option_argument('--results_cache_max_age', type=int)
+add_option_argument('--measurement_info_cache_max_age', type=int)
+add_option_argument('--log_level', type=str, choices=valid_log_levels)
+add_option_argument('--oldest_atlas_result_datetime', type=str)
+add_option_argument('-P', '--do_not_list_probes', action='store_true')
+add_option_argument('--probe_properties_to_report', type=str)
+add_option_argument('-r', '--raw_probe_properties_file_max_age', type=int)
+add_option_argument('--ripe_atlas_current_probe_properties_url', type=str)
+add_option_argument('--ripe_atlas_probe_properties_json_cache_file', type=str)
+add_option_argument('--ripe_atlas_results_cache_dir', type=str)
+add_option_argument('--ripe_atlas_probe_properties_raw_file', type=str)
+add_option_argument('-s', '--list_slow_probes_only', action='store_true')
+add_option_argument('-S', '--slow_threshold', type=int)
+add_option_argument('-t', '--split_char', type=str)
+add_option_argument('-u', '--print_summary_stats', action='store_true')
+add_option_argument('--scrape', action='store_true')
+add_option_argument('--include_probe_timestamp', action='store_true')
+add_option_argument('--autocomplete', action='store_true')
+add_option_argument('--probes', type=str)
+add_option_argument('--id_servermethod', type=str, choices=valid_id_server_method)
+add_option_argument('--scrape_staleness_seconds', type=int)
 parser.add_argument('filename_or_msmid', help='one or two local filenames or RIPE Atlas Measurement IDs', nargs='+')
 parser.format_help()
 argcomplete.autocomplete(parser)
-args = parser.parse_known_args()
+# (parse_known_args() returns a tuple of the parsed args and any leftovers;
+# we only need the former, and this saves indexing the tuple on every use.)
+args = parser.parse_known_args()[0]
 ###pprint(args)
 
 logger = logging.getLogger()
-logger.setLevel(args[0].log_level)
+logger.setLevel(args.log_level)
 
 
 ####################
 #
 # Config file parse
 #
-my_config_file = args[0].config_file
+my_config_file = args.config_file
 raw_config = configparser.ConfigParser()
 config_file_read = False
 write_config_file = False
@@ -321,7 +358,9 @@ try:
             logger.debug(type(config_file_string))
             logger.debug('config_file_string:')
             logger.debug(config_file_string)
-            if re.search('STRING', config_file_string, re.MULTILINE):
+            # (Old-style config files have 'STRING' in them; a plain
+            # substring test is all that takes.)
+            if 'STRING' in config_file_string:
                 old_style_cf = my_config_file + '.old-style'
                 logger.warning('Old-style config file found; it will be moved to %s' % old_style_cf)
                 logger.warning('A new-style config file with default values written at %s' % my_config_file)
@@ -337,12 +376,11 @@ except FileNotFoundError:
     logger.info('Config file does not exist at %s; will create a new one...\n' % my_config_file)
     write_config_file = True
 if not config_file_read:
+    sample_config_string = build_config_string({k: v['default'] for k, v in options_sample_dict.items()})
+    logger.debug(sample_config_string)
     raw_config.read_string(sample_config_string)
 
-raw_config_options = set(raw_config['DEFAULT'].keys())
-
-# This 'config' dict stores the merged config (from the config file and the sample above).
-config = {}
+raw_config_options = frozenset(raw_config['DEFAULT'].keys())
 
 #options_from_config_file = []
 
@@ -355,42 +393,38 @@ config = {}
 # since the new option was added.)
 if config_file_read:
     logger.debug('options_sample_dict:')
-    logger.debug(set(options_sample_dict))
+    logger.debug(expected_config_items)
     logger.debug('raw_config_options:')
-    logger.debug(set(raw_config_options))
-    for opt in (set(options_sample_dict) - set(raw_config_options)):
+    logger.debug(raw_config_options)
+    for opt in (expected_config_items - raw_config_options):
         logger.info('%s missing from config file; setting it to default from script: %s' %
                      (opt, options_sample_dict[opt]['default']))
-        config[opt] = options_sample_dict[opt]['default']
         write_config_file = True
 
 #
-# Loop through what's in the raw config and see if each variable is in
-# the (following) list of expected config variables, so we can catch
-# any unexpected ("illegal") parameters in the config file, rather
-# than let a typo or some bit of random (non-comment) text in the
-# config file go unnoticed.
-for item in raw_config_options:
-    logger.debug('Checking %s to see if it is known...' % item)
-    if item in expected_config_items:
-        if getattr(args[0], item) != options_sample_dict[item]['default']:
-            config[item] = getattr(args[0], item)
-        else:
-            config[item] = raw_config['DEFAULT'].get(item)
-    else:
-        logger.critical('Unknown parameter in config file: %s\n' % item)
-        exit(1)
+# Check what's in the raw config against the list of expected config
+# variables, so we can catch any unexpected ("illegal") parameters in
+# the config file, rather than let a typo or some bit of random
+# (non-comment) text in the config file go unnoticed.
+unknown_config_options = raw_config_options - expected_config_items
+if unknown_config_options:
+    logger.critical('Unknown parameter in config file: %s\n' % ', '.join(sorted(unknown_config_options)))
+    exit(1)
+
+# This 'config' dict stores the merged config: the options set (to
+# something other than their default) on the command line, then the
+# ones in the config file, then the defaults from the sample above for
+# any missing from the config file.
+changed_on_cli = {k: v for k, v in vars(args).items()
+                  if k in expected_config_items and v != options_sample_dict[k]['default']}
+raw_config_defaults = raw_config['DEFAULT']
+config = {k: (changed_on_cli[k] if k in changed_on_cli else raw_config_defaults[k])
+          if k in raw_config_options else options_sample_dict[k]['default']
+          for k in options_sample_dict}
 
 # Write out the config file
 if write_config_file:
-    config_string_to_write = sample_config_string_header
-    # Iterate over the items in the three options_sample_dict_* (defined above)
-    # and shove them into the big string "sample_config_string" that will then be fed to ConfigParser.
-    for k in options_sample_dict.keys():
-        logger.debug('adding config item %s to config string' % k)
-        config_string_to_write += (';\n')
-        config_string_to_write += ('; ' + options_sample_dict[k]['help'] + '\n')
-        config_string_to_write += (k + ' = ' + str(config[k]) + '\n')
+    config_string_to_write = build_config_string(config)
     logger.debug('Config string to write:\n')
     logger.debug(config_string_to_write)
     logger.info('Writing config file at: %s\n' % my_config_file)
@@ -398,24 +432,31 @@ if write_config_file:
         cf.write(config_string_to_write)
 
 # What we get from configparser is a string. For
-# probe_properties_to_report, we need convert this string to a list.
+# probe_properties_to_report, we need convert this string (a JSON list)
+# to a list.  Config files written by older versions of this script have
+# it as a python list literal instead, so fall back to reading it as one.
 # (ast.literal_eval() is safer than plain eval())
-probe_properties_to_report = ast.literal_eval(config['probe_properties_to_report'])
+try:
+    probe_properties_to_report = json.loads(config['probe_properties_to_report'])
+except ValueError:
+    import ast
+    probe_properties_to_report = ast.literal_eval(config['probe_properties_to_report'])
 
-logger.debug('Config dict:')
-for k, v in config.items():
-    logger.debug('%s : %s' % (k, v))
+if logger.isEnabledFor(logging.DEBUG):
+    logger.debug('Config dict:')
+    for k, v in config.items():
+        logger.debug('%s : %s', k, v)
 
 # Put the remaining command line arguments into a list to process as files
 # or measurement IDs.
-data_sources = args[0].filename_or_msmid
+data_sources = args.filename_or_msmid
 
 # We need an idea of current unix time to decide if user-supplied
 # date-times are good.
 # First, let's figure out what the current unix time is in UTC.
 current_unixtime = int(time.time())
 # unix-time representation of config['oldest_atlas_result_datetime'], which is hardcoded up above.
-oldest_result_unixtime = int(time.mktime(time.strptime(str(config['oldest_atlas_result_datetime']), '%Y %m %d %H:%M:%S')))
+oldest_result_unixtime = calendar.timegm(time.strptime(str(config['oldest_atlas_result_datetime']), '%Y %m %d %H:%M:%S'))
 
 ##################################################
 #
@@ -428,9 +469,15 @@ def is_valid_unixtime(_possible_unixtime):
     if isinstance(_possible_unixtime, int) and int(_possible_unixtime) < current_unixtime and int(_possible_unixtime) >= oldest_result_unixtime:
         return True
     else:
-        logger.debug(str(_possible_unixtime) + ' is not inbetween ' + str(oldest_result_unixtime) + ' and ' + str(current_unixtime) + '.\n')
+        logger.debug('%s is not inbetween %s and %s.\n', _possible_unixtime, oldest_result_unixtime, current_unixtime)
         return False
 
+##########
+# The usual shapes of the datetime strings we accept (see the list of
+# formats in user_datetime_to_valid_unixtime, below): YYYYMMDD, optionally
+# followed by HHMM, or by a '_', '.' or ' ' and HHMM or HH:MM, or
+# YYYY-MM-DD, followed by a '_' or '-' and HHMM or HH:MM.
+user_datetime_re = re.compile(r'(\d{4})(\d{2})(\d{2})(?:[_. ](\d{2}):?(\d{2})|(\d{2})(\d{2}))?|(\d{4})-(\d{2})-(\d{2})[_-](\d{2}):?(\d{2})')
 ##########
 # Try a few formats to convert the datetime string they've supplied into unixtime
 def user_datetime_to_valid_unixtime(user_dt_string):
@@ -445,13 +492,28 @@ def user_datetime_to_valid_unixtime(user_dt_string):
     # the 1 Jan 1970 Epoch)
     if is_valid_unixtime(user_dt_string):
         return int(user_dt_string)
-    # It's not unix time, so try to convert from some data time formats
+    # It's not unix time.  Most of the time it will match one of the usual
+    # shapes, so pull the year, month, day (and maybe hour and minute) out
+    # of it and build the (UTC) time from those directly, rather than
+    # working our way through the formats list.
+    _match = user_datetime_re.fullmatch(user_dt_string)
+    if _match:
+        _fields = [int(g) for g in _match.groups() if g is not None]
+        try:
+            _unixtime_candidate = int(datetime(*_fields, tzinfo=timezone.utc).timestamp())
+            if is_valid_unixtime(_unixtime_candidate):
+                logger.debug('Accepted %i as valid unixtime.\n', _unixtime_candidate)
+                return (_unixtime_candidate)
+        except ValueError:
+            ...
+    # Otherwise, try to convert from some data time formats
     for f in accepted_datetime_formats:
         try:
-            # print (user_dt_string + ' / ' + f) and offset the time zone to UTC
-            _unixtime_candidate = int(time.mktime(time.strptime(user_dt_string, f))) - time.timezone
+            # print (user_dt_string + ' / ' + f)
+            # (timegm() treats the parsed time as UTC, whatever the local time zone is.)
+            _unixtime_candidate = calendar.timegm(time.strptime(user_dt_string, f))
             if is_valid_unixtime(_unixtime_candidate):
-                logger.debug('Accepted %i as valid unixtime.\n' % _unixtime_candidate)
+                logger.debug('Accepted %i as valid unixtime.\n', _unixtime_candidate)
                 return (_unixtime_candidate)
         except ValueError:
             ...
@@ -460,7 +522,7 @@ def user_datetime_to_valid_unixtime(user_dt_string):
     exit(2)
 
 # A list that might contain the user-supplied time period durations
-# durations = [args[0].duration1, args[0].duration2 ]
+# durations = [args.duration1, args.duration2 ]
 # A list that might contain the unixtime representation of the user-supplied start times
 unixtimes = [0, 0]
 
@@ -473,6 +535,9 @@ class fmt:
     bright_red = '\033[91m'
     bright_yellow = '\033[93m'
     bright_magenta = '\033[95m'
+    # combinations of the above
+    bold_bright_green = bold + bright_green
+    bold_bright_red = bold + bright_red
 ####
 
 #####
@@ -518,11 +583,23 @@ m_total_responses = {}
 # their ASN, IP address, country, etc.
 p_probe_properties = {}
 #
+# The pm_ dictionaries are keyed by results set id, and each holds a
+# dictionary keyed by the (integer) probe id.
 pm_response_time = {}
 pm_dns_server_substring = {}
 #
+# The unique set of (int) probe IDs that responded, per results set.  (The
+# results can have as many as 2x duplicates, so process_request() builds
+# these as sets from the start.)
 m_seen_probe_ids = {}
-m_seen_probe_ids_set = {}
+#
+# All of the per-results-set dictionaries that process_request() fills in,
+# so a results set that was processed in another process can be copied
+# back into them.
+results_set_dicts = (m_ip_version, m_response_times, m_timestamps, m_total_response_time,
+                     m_total_malformeds, m_total_abuf_malformeds, m_total_errors, m_total_slow,
+                     m_response_time_average, m_response_time_std_dev, m_total_responses,
+                     pm_response_time, pm_dns_server_substring, m_seen_probe_ids)
 
 # class probe_info:
 #     '''
@@ -542,19 +619,19 @@ m_seen_probe_ids_set = {}
 #     def id(self):
 
 # if autocomplete option is set, register all the options for autocomplete then exit
-if args[0].autocomplete:
+if args.autocomplete:
     prog = sys.argv[0].removeprefix("./")
     print(f'source <(register-python-argcomplete {prog})')
     os.system('source <(register-python-argcomplete {prog})')
     exit()
 
 # Validate the supplied date-times and stick them in a list
-if args[0].datetime1:
-    logger.debug(args[0].datetime1)
-    unixtimes[0] = user_datetime_to_valid_unixtime(args[0].datetime1)
-if args[0].datetime2:
-    logger.debug(args[0].datetime2)
-    unixtimes[1] = user_datetime_to_valid_unixtime(args[0].datetime2)
+if args.datetime1:
+    logger.debug(args.datetime1)
+    unixtimes[0] = user_datetime_to_valid_unixtime(args.datetime1)
+if args.datetime2:
+    logger.debug(args.datetime2)
+    unixtimes[1] = user_datetime_to_valid_unixtime(args.datetime2)
 
 # Because this script is written to compare two measurement results, or
 # just report one, this is kinda complicated:
@@ -597,37 +674,177 @@ else:
 
 ####################
 #
-# Process the data, either from a local file or by requesting it over the
-# 'net from RIPE Atlas.
+# Results fetched from the RIPE Atlas API are cached (as gzipped JSON) in
+# config['ripe_atlas_results_cache_dir'], one file per request, named
+# after a hash of the request's parameters. Files older than
+# config['results_cache_max_age'] are removed whenever a new one is
+# written, so the directory does not grow forever.
+def ripe_results_cache_file(request_kwargs):
+    cache_key = repr(sorted(request_kwargs.items())).encode()
+    return os.path.join(config['ripe_atlas_results_cache_dir'], hashlib.sha1(cache_key).hexdigest() + '.json.gz')
+#
+# Return the cached results for a request, or None if there aren't any
+# (or they are older than max_age seconds).
+def read_ripe_results_cache(request_kwargs, max_age):
+    cache_file = ripe_results_cache_file(request_kwargs)
+    try:
+        if (current_unixtime - os.path.getmtime(cache_file)) > max_age:
+            logger.debug('Cached results in %s are too old to use.\n', cache_file)
+            return None
+        with gzip.open(cache_file, 'rb') as f:
+            if orjson is not None:
+                return orjson.loads(f.read())
+            else:
+                return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError) as e:
+        logger.warning('Cannot read cached results from %s (%s); fetching them again.\n' % (cache_file, e))
+        return None
+#
+# Save the results of a request in the cache.
+def write_ripe_results_cache(request_kwargs, results):
+    cache_file = ripe_results_cache_file(request_kwargs)
+    try:
+        os.makedirs(config['ripe_atlas_results_cache_dir'], exist_ok=True)
+        with gzip.open(cache_file, 'wb') as f:
+            if orjson is not None:
+                f.write(orjson.dumps(results))
+            else:
+                f.write(json.dumps(results).encode())
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning('Cannot cache results in %s (%s)\n' % (cache_file, e))
+        return
+    # Prune the expired cache files.
+    max_age = int(config['results_cache_max_age'])
+    try:
+        with os.scandir(config['ripe_atlas_results_cache_dir']) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json.gz') and (current_unixtime - entry.stat().st_mtime) > max_age:
+                    logger.debug('Removing expired cached results %s\n', entry.path)
+                    os.remove(entry.path)
+    except OSError as e:
+        logger.warning('Cannot prune expired cached results in %s (%s)\n' % (config['ripe_atlas_results_cache_dir'], e))
 #
-def process_request(_data_source, _results_set_id, _unixtime, probes = []):
+# The interval and address family (protocol) of a measurement hardly
+# ever change, so they are cached too (one small JSON file per
+# measurement, in the same directory), rather than asking the RIPE
+# Atlas API for them on every run.  They are also kept in
+# measurement_info_cache, so they are only looked up once per run, and
+# the lock keeps both fetch threads from asking the API for them at the
+# same time.  (Results sets processed in separate processes each have a
+# cache and a lock of their own, so the main loop looks up the info for
+# any measurement IDs it was given before starting them.  The file is
+# written to a temporary file first, so a process reading it never sees
+# it half written.)
+measurement_info_cache = {}
+measurement_info_cache_lock = threading.Lock()
+def get_measurement_info(measurement_id):
+    with measurement_info_cache_lock:
+        if measurement_id in measurement_info_cache:
+            return measurement_info_cache[measurement_id]
+        cache_file = os.path.join(config['ripe_atlas_results_cache_dir'], 'measurement-%i.json' % measurement_id)
+        measurement_info = None
+        try:
+            if (current_unixtime - os.path.getmtime(cache_file)) <= int(config['measurement_info_cache_max_age']):
+                with open(cache_file, 'rb') as f:
+                    measurement_info = json.load(f)
+                logger.debug('Using cached info for Measurement %i: %s\n', measurement_id, measurement_info)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning('Cannot read cached measurement info from %s (%s); fetching it again.\n' % (cache_file, e))
+        if measurement_info is None:
+            from ripe.atlas.cousteau import Measurement
+            measurement = Measurement(id=measurement_id)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(dir(measurement))
+            measurement_info = {'interval': measurement.interval,
+                                'protocol': int(measurement.protocol)}
+            try:
+                os.makedirs(config['ripe_atlas_results_cache_dir'], exist_ok=True)
+                # (Named for this process, in case another one is writing it too.)
+                tmp_cache_file = '%s.%i.tmp' % (cache_file, os.getpid())
+                with open(tmp_cache_file, 'w') as f:
+                    json.dump(measurement_info, f)
+                os.replace(tmp_cache_file, cache_file)
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning('Cannot cache measurement info in %s (%s)\n' % (cache_file, e))
+        measurement_info_cache[measurement_id] = measurement_info
+        return measurement_info
+# END of the RIPE Atlas results cache functions
+####################
+#
+# Does a data source (that isn't a local file) look like a RIPE Atlas
+# Measurement ID (an 8-digit number)?  (Plain string tests are much
+# cheaper than a regex for this.)
+def is_measurement_id(_data_source):
+    return len(_data_source) == 8 and _data_source.isascii() and _data_source.isdigit()
+####################
+#
+# Stream the results (one probe's result at a time) out of an opened local
+# results file, rather than reading the whole (possibly very large) JSON
+# array of results into memory at once.
+def stream_results_file(results_file, _data_source):
+    import ijson
+    try:
+        with results_file:
+            yield from ijson.items(results_file, 'item', use_float=True)
+    except ijson.JSONError as e:
+        logger.critical('Cannot read the results in %s (%s)\n' % (_data_source, e))
+        sys.exit(12)
+####################
+#
+# Fetch the results for a data source, either from a local file or by
+# requesting them over the 'net from RIPE Atlas.  This does no
+# aggregation (and touches none of the m_* dictionaries), so the
+# fetches for both data sources can be run at the same time.
+#
+# Results from a local file are streamed through, rather than read in, so
+# they are only returned (as a list) if keep_results is set.
+#
+# Returns the measurement ID (None for a local file, where it is only
+# known once the results are read) and the results.
+#
+def fetch_results(_data_source, _unixtime, probes = [], keep_results = False):
     logger.info('Trying to access data_source %s for unixtime %s\n' % (_data_source, _unixtime))
+    measurement_id = None
     # First we try to open the _data_source as a local file.  If it exists,
     # read in the measurement results from a filename the user has
     # supplied.
     #
-    # This code currently reads everything in, but it should be
+    # This code currently reads everything, but it should be
     # modified to only load the data from the user-supplied time range,
     # if the user supplied one.
-    try:
-        f = open(_data_source, "r")
-        results = json.load(f)
-        f.close()
+    #
+    # (Check that there is such a file first, rather than having open()
+    # raise an exception for every Measurement ID.)
+    results_file = None
+    if os.path.isfile(_data_source):
+        try:
+            results_file = open(_data_source, 'rb')
+        except OSError as e:
+            logger.debug('cannot open file %s: %s\n', _data_source, e)
+    if results_file is not None:
+        results = stream_results_file(results_file, _data_source)
+        if keep_results:
+            results = list(results)
         if _unixtime != 0:
             logger.critical('This script does not yet know how to read user-supplied time ranges out of local files.\n (But it can query the RIPE Atlas API for time ranges, so maybe you wanna do that instead?\n')
-    except:
-        logger.debug('cannot read from file: %s\n' % _data_source)
+    else:
+        logger.debug('cannot read from file: %s\n', _data_source)
         # If we are here, accessing _data_sources as a local file did not
         # work.  Next, we try to check to see if _data_source is an 8-digit
         # number.  If it is, then we assume it is an Atlas Measurement ID
         # and query their API with it.
-        if re.match(r'^[0-9]{8}$', _data_source):
+        if is_measurement_id(_data_source):
             # use it to make the request, but the measurement ID in the
             # returned data will be passed back to the code calling this
             # function, potentially redefining the measurement ID from
             # what the user supplied. (That really should not happen, but
             # the world is a weird place.)
             measurement_id = int(_data_source)
+            from ripe.atlas.cousteau import AtlasLatestRequest, AtlasResultsRequest
             # If we have no unixtime to request results from, then we get the latest results
             if _unixtime == 0:
                 kwargs = {
@@ -635,14 +852,21 @@ def process_request(_data_source, _results_set_id, _unixtime, probes = []):
                     "probe_ids": probes
                 }
                 logger.info('Fetching latest results for Measurement %i from RIPE Atlas API...\n' % measurement_id)
-                is_success, results = AtlasLatestRequest(**kwargs).create()
+                atlas_request = AtlasLatestRequest
+                # The latest results keep changing, so only reuse them for a
+                # little while (if at all), and never when scraping, as that
+                # should always report the latest results.
+                if args.scrape:
+                    results_cache_max_age = 0
+                else:
+                    results_cache_max_age = int(config['latest_results_cache_max_age'])
             # We have a unixtime, so:
             # * use it as a start time
             # * add duration to it for the stoptime
             # * request the results
             else:
-                measurement = Measurement(id=measurement_id)
-                _stop_time = (_unixtime + measurement.interval - 300)
+                interval = get_measurement_info(measurement_id)['interval']
+                _stop_time = (_unixtime + interval - 300)
                 kwargs = {
                     "msm_id": measurement_id,
                     "start": _unixtime,
@@ -650,13 +874,58 @@ def process_request(_data_source, _results_set_id, _unixtime, probes = []):
                     "probe_ids": probes
                 }
                 logger.info('Fetching results for Measurement %i,  start unixtime: %s  stop unixtime: %s\n' % (measurement_id, _unixtime, _stop_time))
-                is_success, results = AtlasResultsRequest(**kwargs).create()
+                atlas_request = AtlasResultsRequest
+                # Once the time period is well over, its results should not
+                # change any more, so they can be cached for longer.
+                if _stop_time < current_unixtime - interval:
+                    results_cache_max_age = int(config['results_cache_max_age'])
+                else:
+                    results_cache_max_age = int(config['latest_results_cache_max_age'])
+            # (A max age of 0 means the results are neither read from nor
+            # written to the cache.)
+            if results_cache_max_age > 0:
+                results = read_ripe_results_cache(kwargs, results_cache_max_age)
+            else:
+                results = None
+            if results is not None:
+                logger.info('Using cached results for Measurement %i\n' % measurement_id)
+                is_success = True
+            else:
+                is_success, results = atlas_request(**kwargs).create()
+                if is_success and results_cache_max_age > 0:
+                    write_ripe_results_cache(kwargs, results)
             if not is_success:
                 logger.critical('Request of ' + _data_source + 'from RIPE Atlas failed.\n')
                 exit(11)
         else:
             logger.critical('Cannot read from ' + _data_source + ' and it does look like a RIPE Atlas Measurement ID\n')
             sys.exit(12)
+    return measurement_id, results
+
+# END def fetch_results
+####################
+
+####################
+#
+# Process one results set, for running in another process: returns the
+# measurement ID, and that set's entries in the results_set_dicts, to be
+# copied back into them by the calling process.
+def process_results_set(_data_source, _results_set_id, _unixtime, probes = []):
+    measurement_id = process_request(_data_source, _results_set_id, _unixtime, probes)[0]
+    return measurement_id, [d[_results_set_id] for d in results_set_dicts]
+#
+####################
+
+####################
+#
+# Process the data for a data source, fetching it first (with
+# fetch_results()) unless it has already been fetched and passed in.
+#
+def process_request(_data_source, _results_set_id, _unixtime, probes = [], keep_results = False, fetched = None):
+    from ripe.atlas.sagan import DnsResult
+    if fetched is None:
+        fetched = fetch_results(_data_source, _unixtime, probes, keep_results)
+    measurement_id, results = fetched
 
     # Variables that start with a m_ are specific to measurements.
     # All of the m_* dictionaries are initialized at the top of the script.
@@ -672,20 +941,60 @@ def process_request(_data_source, _results_set_id, _unixtime, probes = []):
     m_response_time_average[_results_set_id] = 0
     m_response_time_std_dev[_results_set_id] = 0
     #
-    m_response_times[_results_set_id] = []
-    m_timestamps[_results_set_id] = []
-    # The list of seen probe IDs for this measurement-result-set
-    m_seen_probe_ids[_results_set_id] = []
-    m_probe_ids_to_exclude = []
-
-    if args[0].exclusion_list_file:
+    # The lists, set and dicts for this _results_set_id are also bound to
+    # locals, and the counters are kept in locals until the loop below is
+    # done, so the loop does not have to look them up in the (global) m_*
+    # and pm_* dictionaries for every result.
+    response_times = m_response_times[_results_set_id] = []
+    timestamps = m_timestamps[_results_set_id] = []
+    # The set of seen (integer) probe IDs for this measurement-result-set
+    seen_probe_ids = m_seen_probe_ids[_results_set_id] = set()
+    # Per-probe results for this results set
+    probe_response_time = pm_response_time[_results_set_id] = {}
+    probe_dns_server_substring = pm_dns_server_substring[_results_set_id] = {}
+    total_responses = 0
+    total_malformeds = 0
+    total_abuf_malformeds = 0
+    total_errors = 0
+    # (A set of integer probe IDs, as it is checked for every result.)
+    m_probe_ids_to_exclude = set()
+
+    if args.exclusion_list_file:
         try:
-            with open(args[0].exclusion_list_file, 'r') as f:
-                m_probe_ids_to_exclude = f.read().splitlines()
+            with open(args.exclusion_list_file, 'r') as f:
+                m_probe_ids_to_exclude = set(int(line) for line in f.read().splitlines() if line.isdigit())
         except IOError:
-            logger.critical ('Cannot read probe exclusion list from file: %s\n' % args[0].exclusion_list_file)
+            logger.critical ('Cannot read probe exclusion list from file: %s\n' % args.exclusion_list_file)
             exit(13)
 
+    # Decide (once, rather than for every result in the loop below) how
+    # to pick the substring to report out of each DNS server response.
+    split_char = args.split_char
+    item_occurence_to_return = args.dns_response_item_occurence_to_return
+    if split_char == '!':
+        # '!' means do not split up the response text at all
+        def dns_server_substring(dns_server_fqdn):
+            logger.debug('%s\n', dns_server_fqdn)
+            return dns_server_fqdn
+    else:
+        # There's no need to split the text any further than the item we
+        # return (unless it is counted from the end of the list).
+        if item_occurence_to_return >= 0:
+            max_splits = item_occurence_to_return + 1
+        else:
+            max_splits = -1
+        def dns_server_substring(dns_server_fqdn):
+            split_result = dns_server_fqdn.split(split_char, max_splits)
+            if len(split_result) > item_occurence_to_return:
+                # (Items counted from the end of the list can run off its
+                # start, which means there is no such item in the reply.)
+                if item_occurence_to_return >= -len(split_result):
+                    return split_result[item_occurence_to_return]
+                else:
+                    return 'no_reply'
+            else:
+                return dns_server_fqdn
+
     # Loop through each (probe) result that come back from the call to DnsResult.
     for r in results:
         # this next line parses the data in r:
@@ -699,7 +1008,7 @@ def process_request(_data_source, _results_set_id, _unixtime, probes = []):
         # Probe exclusion list handling, doing it here as to do it as
         # close to the source as possible. That is, as soon as we know
         # the ID's of the probes, we exclude those we don't want.
-        if str(dns_result.probe_id) in m_probe_ids_to_exclude:
+        if dns_result.probe_id in m_probe_ids_to_exclude:
             continue
 
         #
@@ -710,20 +1019,21 @@ def process_request(_data_source, _results_set_id, _unixtime, probes = []):
         # cheaper than deciding if we should read it our of the result and
         # set measurement_id, or not.
         measurement_id = int(dns_result.measurement_id)
-        # generate an response_set + probe_id to use as an index into
-        # various dicts with responses
-        results_and_probes_id = str(_results_set_id) + '-' + str(dns_result.probe_id)
-        # Add the probe_id to the seen list.  We need to cast it to a
-        # string, because the corresponding probe IDs in probe_info data
-        # will be indexed by probe_id as a string.  (Because python.)
-        m_seen_probe_ids[_results_set_id].append(str(dns_result.probe_id))
-        m_total_responses[_results_set_id] += 1
+        # Add the probe_id to the seen set.
+        seen_probe_ids.add(dns_result.probe_id)
+        total_responses += 1
         # Check for malformed responses or errors, and count them
         if dns_result.is_malformed:
-            m_total_malformeds[_results_set_id] += 1
+            total_malformeds += 1
         elif dns_result.is_error:
-            m_total_errors[_results_set_id] += 1
+            total_errors += 1
         else:
+            # Bind the first response, its response time and answer buffer
+            # to locals, rather than walking dns_result's attributes for them
+            # again and again below.
+            response = dns_result.responses[0]
+            response_time = response.response_time
+            abuf = response.abuf
             # Even more (abuf) error checks...
             #
             # first check if there is even a dns_result.responses[0].abuf,
@@ -732,54 +1042,60 @@ def process_request(_data_source, _results_set_id, _unixtime, probes = []):
             # following code, but determining which lines can be skipped
             # adds complexity to this bug fix, so johan is not going to do
             # that right now.)
-            if dns_result.responses[0].abuf:
-                logger.debug('dns_result.responses[0].abuf: %s\n' % (dns_result.responses[0].abuf))
-                if dns_result.responses[0].abuf.is_malformed:
-                    m_total_abuf_malformeds[_results_set_id] += 1
+            #
+            # (Test the abufs against None, rather than for truth: sagan's
+            # objects have no __bool__, so python falls back to their
+            # __len__, which walks dir() of the whole object every time.)
+            if abuf is not None:
+                logger.debug('dns_result.responses[0].abuf: %s\n', abuf)
+                if abuf.is_malformed:
+                    total_abuf_malformeds += 1
             #            try dns_result.responses[1].get:
             if len(dns_result.responses) > 1: ### FIXME: Should this be 0 instead of 1?
-                if dns_result.responses[1].abuf:
-                    if dns_result.responses[1].abuf.is_malformed:
-                        m_total_abuf_malformeds[_results_set_id] += 1
+                second_abuf = dns_result.responses[1].abuf
+                if second_abuf is not None and second_abuf.is_malformed:
+                    total_abuf_malformeds += 1
             # Appended results to the dicts...
-            m_response_times[_results_set_id].append(dns_result.responses[0].response_time)
-            m_total_response_time[_results_set_id] += (dns_result.responses[0].response_time)
-            if dns_result.responses[0].response_time > args[0].slow_threshold:
-                m_total_slow[_results_set_id] += 1
-            m_timestamps[_results_set_id].append(dns_result.created_timestamp)
+            response_times.append(response_time)
+            timestamps.append(dns_result.created_timestamp)
             #
-            pm_response_time[results_and_probes_id] = dns_result.responses[0].response_time
+            probe_response_time[dns_result.probe_id] = response_time
 
             # Not all of the DNS responses Atlas receives contain answers,
-            # so we need to handle responses without them.
-            try:
-                dns_server_fqdn = dns_result.responses[0].abuf.answers[0].data[0]
-                #
-                # Split up the response text
-                if args[0].split_char == '!':
-                    split_result = dns_server_fqdn
-                    logger.debug('%s\n' % (dns_server_fqdn))
+            # so we need to handle responses without them.  (Check for them
+            # explicitly, as they are common enough that raising and
+            # catching exceptions for them would be expensive.)
+            answers = getattr(abuf, 'answers', None)
+            if answers is None:
+                probe_dns_server_substring[dns_result.probe_id] = 'no_data'
+            elif not answers:
+                probe_dns_server_substring[dns_result.probe_id] = 'no_reply'
+            else:
+                answer_data = getattr(answers[0], 'data', None)
+                if answer_data is None:
+                    probe_dns_server_substring[dns_result.probe_id] = 'no_data'
+                elif not answer_data:
+                    probe_dns_server_substring[dns_result.probe_id] = 'no_reply'
                 else:
-                    split_result = dns_server_fqdn.split(args[0].split_char)
-                    if len(split_result) > args[0].dns_response_item_occurence_to_return:
-                        pm_dns_server_substring[results_and_probes_id] = split_result[args[0].dns_response_item_occurence_to_return]
-                    else:
-                        pm_dns_server_substring[results_and_probes_id] = dns_server_fqdn
-            except IndexError:
-                pm_dns_server_substring[results_and_probes_id] = 'no_reply'
-            except AttributeError:
-                pm_dns_server_substring[results_and_probes_id] = 'no_data'
-
-    measurement = Measurement(id=measurement_id)
-    logger.debug(dir(measurement))
-    m_ip_version[_results_set_id] = int(measurement.protocol)
-    logger.debug("Address family for measurement %i is %i\n" % (measurement_id, m_ip_version[_results_set_id]))
-
-    # Sort some of the lists of results
-    m_response_times[_results_set_id].sort()
-    m_timestamps[_results_set_id].sort()
-    m_seen_probe_ids[_results_set_id].sort()
-    logger.debug('m_seen_probe_ids[_results_set_id] is %d\n' % len(m_seen_probe_ids[_results_set_id]))
+                    # Split up the response text
+                    probe_dns_server_substring[dns_result.probe_id] = dns_server_substring(answer_data[0])
+
+    m_total_responses[_results_set_id] = total_responses
+    m_total_malformeds[_results_set_id] = total_malformeds
+    m_total_abuf_malformeds[_results_set_id] = total_abuf_malformeds
+    m_total_errors[_results_set_id] = total_errors
+
+    m_ip_version[_results_set_id] = get_measurement_info(measurement_id)['protocol']
+    logger.debug("Address family for measurement %i is %i\n", measurement_id, m_ip_version[_results_set_id])
+
+    # Total up the response times in one go, rather than one at a time in the loop above.
+    m_total_response_time[_results_set_id] = sum(response_times)
+    # Count the slow responses with a single pass over the list.  (The
+    # response times and timestamps are left unsorted, as only their min
+    # and max are ever reported.)
+    slow_threshold = args.slow_threshold
+    m_total_slow[_results_set_id] = sum(1 for rt in response_times if rt > slow_threshold)
+    logger.debug('m_seen_probe_ids[_results_set_id] is %d\n', len(seen_probe_ids))
     return measurement_id, results
 
 # END def process_request
@@ -807,78 +1123,216 @@ def process_request(_data_source, _results_set_id, _unixtime, probes = []):
 # (dictionary) the additional info that's pulled down by via the Atlas
 # API.
 #
-# This script then caches that "combined" dictionary as an uncompressed JSON file.
+# This script then caches that "combined" dictionary as a pickle file.  (It
+# is only ever read back in by this script, so there's nothing to be gained
+# from JSON, and pickle is quicker to load and much smaller.)  The
+# dictionary is keyed on the (integer) probe IDs, just like the results
+# have them, so they never need converting to strings to look them up.
 #
 # So the first thing this function does is read in the probe properties
-# JSON cache file, if it exists.  Then, if RIPE's raw file is newer, it
+# cache file, if it exists.  Then, if RIPE's raw file is newer, it
 # loads into the prope properties dictionary the data from RIPE's
 # (probably just downloaded) file on top of the cached file.  Then it
-# writes out that dictionary as a JSON file, for use next time.
+# writes out that dictionary as a pickle file, for use next time.
+#
+# It returns a status code (0 if all went well) and the probe properties
+# dictionary itself, so the caller does not have to read the cache file
+# back in again.
+#
+# Older versions of this script saved the probe properties cache as JSON,
+# and the config files they wrote still name it that way
+# (.RIPE_atlas_probe_properties_cache_file.json).  So the pickle for a
+# cache file name ending in .json goes next to it, ending in .pickle, and
+# the JSON file is left alone.
+def probe_properties_pickle_file(ppcf):
+    root, ext = os.path.splitext(ppcf)
+    if ext == '.json':
+        return root + '.pickle'
+    return ppcf
+#
+# Read in the probe properties cache file.  Returns the dictionary, and
+# whether it came from an older (JSON) cache file, rather than a pickle.
+# The older cache files hold the info fetched from the RIPE Atlas API for
+# the (many) probes missing from RIPE's raw file, which would otherwise all
+# have to be fetched again, so they are read in if there's no pickle yet
+# (or if the configured file turns out not to be one).  (JSON keys are
+# strings, so the dictionary is re-keyed on the integer probe IDs.)
+#
+# Raises FileNotFoundError if there's no cache file at all, and OSError,
+# EOFError, pickle.UnpicklingError or ValueError if it can't be read.
+def read_probe_properties_cache_file(ppcf):
+    pickle_file = probe_properties_pickle_file(ppcf)
+    try:
+        with open(pickle_file, 'rb') as f:
+            return pickle.load(f), False
+    except FileNotFoundError:
+        if pickle_file == ppcf:
+            raise
+    except (EOFError, pickle.UnpicklingError):
+        if pickle_file != ppcf:
+            raise
+    logger.info('Reading in the older (JSON) local cache file %s...\n' % ppcf)
+    with open(ppcf, 'rb') as f:
+        return {int(k): v for k, v in json.load(f).items()}, True
+#
+# Write the probe properties dictionary out to the cache file.  It is
+# written to a temporary file first, which then replaces the cache file,
+# so an interrupted write never leaves a truncated cache file behind.
+def write_probe_properties_cache_file(ppcf, all_probes_dict):
+    pickle_file = probe_properties_pickle_file(ppcf)
+    # (A per-process name for the temporary file, so concurrent runs don't
+    # clobber each other's.)
+    tmp_pickle_file = '%s.%i.tmp' % (pickle_file, os.getpid())
+    try:
+        with open(tmp_pickle_file, 'wb') as f:
+            pickle.dump(all_probes_dict, f, protocol=5)
+        os.replace(tmp_pickle_file, pickle_file)
+    except BaseException:
+        try:
+            os.remove(tmp_pickle_file)
+        except OSError:
+            pass
+        raise
 #
 def check_update_probe_properties_cache_file(pprf, ppcf, ppurl):
+    # to decompress RIPE Atlas probe data file
+    import bz2
+    # to stream the (large) RIPE Atlas probe data file instead of reading it all in
+    import ijson
+    # needed to fetch the probe properties file from RIPE
+    import email.utils
+    import urllib.error
+    import urllib.request
     all_probes_dict = {}
     # If the probe properties cache file exists, read it into the all probes dictionary.
     try:
-        ppcf_statinfo = os.stat(ppcf)
-        ppcf_age = int(ppcf_statinfo.st_mtime)
-        logger.info('Reading in existing local JSON cache file %s...\n' % ppcf)
-        with open(ppcf, 'r') as f:
-            all_probes_dict = json.load(f)
-    except:
+        all_probes_dict, from_json_cache = read_probe_properties_cache_file(ppcf)
+        if from_json_cache:
+            # Regenerate it, so it is saved as a pickle.
+            logger.info('Local cache file %s is an older JSON one; regenerating it as %s.\n' %
+                        (ppcf, probe_properties_pickle_file(ppcf)))
+            ppcf_age = -1
+        else:
+            logger.info('Read in existing local cache file %s.\n' % probe_properties_pickle_file(ppcf))
+            ppcf_age = int(os.path.getmtime(probe_properties_pickle_file(ppcf)))
+    except FileNotFoundError:
         # The cache file does not seem to exist, so set the age to
         # zero, to trigger rebuild.
-        logger.info('Local JSON cache file %s does not exist; generating it.\n' % ppcf)
+        logger.info('Local cache file %s does not exist; generating it.\n' % ppcf)
+        ppcf_age = -1
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError) as e:
+        # The cache file is unreadable (or corrupt), so rebuild it too.
+        logger.warning('Cannot read local cache file %s (%s); regenerating it.\n' % (ppcf, e))
         ppcf_age = -1
 
     try:
         # Check to see if the raw file (that's downloaded from RIPE)
         # exists, and if so get its last mtime.
-        pprf_statinfo = os.stat(pprf)
-        pprf_age = int(pprf_statinfo.st_mtime)
-    except:
+        pprf_age = int(os.path.getmtime(pprf))
+    except OSError:
         # The raw file does not seem to exist, so set the age to zero,
         # and assume the age evaluation will try trigger a download.
         pprf_age = 0
 
     # Check to see if the current time minus the raw file age is more than the expiry
     if ((current_unixtime - pprf_age) > int(config['raw_probe_properties_file_max_age'])):
-        # Fetch a new raw file, and generate the JSON format cache file
+        # Fetch a new raw file, and generate the cache file
+        # If we already have a raw file, only ask for a new one if RIPE has
+        # modified it since then (otherwise RIPE just returns a 304 response).
+        # The ETag RIPE sent with the raw file, if any, is kept next to it.
+        request_headers = {}
+        if pprf_age > 0:
+            request_headers['If-Modified-Since'] = email.utils.formatdate(pprf_age, usegmt=True)
+            try:
+                with open(pprf + '.etag', 'r') as f:
+                    request_headers['If-None-Match'] = f.read().strip()
+            except OSError:
+                pass
         try:
             logger.info ('%s is out of date, so trying to fetch fresh probe data from RIPE...\n' % pprf)
-            urlretrievefilename, headers = urllib.request.urlretrieve(ppurl, filename=pprf)
-            html = open(pprf)
-            html.close()
-        except:
-            logger.critical('Cannot urlretrieve %s -- continuing without updating %s \n' %
-             (ppurl, pprf))
-            os.replace(pprf + '.old', pprf)
-            return(2)
-
-    # If the raw file is newer than the local JSON cache file, decompress
+            # Copy the (large) download in 1 MiB chunks into a temporary
+            # file that only replaces the raw file once it is complete, so
+            # a failed download leaves the old raw file as it was (and no
+            # partial download is left lying around).  A connection that
+            # is dropped early just looks like the end of the download,
+            # so the bytes copied are checked against the Content-Length,
+            # as urlretrieve() does.
+            tmp_pprf = '%s.%i.tmp' % (pprf, os.getpid())
+            try:
+                with urllib.request.urlopen(urllib.request.Request(ppurl, headers=request_headers)) as response:
+                    downloaded_size = 0
+                    with open(tmp_pprf, 'wb') as f:
+                        while True:
+                            chunk = response.read(1 << 20)
+                            if not chunk:
+                                break
+                            f.write(chunk)
+                            downloaded_size += len(chunk)
+                    etag = response.headers.get('ETag')
+                    expected_size = response.headers.get('Content-Length')
+                if expected_size is not None and downloaded_size < int(expected_size):
+                    raise urllib.error.ContentTooShortError('only %i of %s bytes were downloaded' %
+                                                            (downloaded_size, expected_size), None)
+                os.replace(tmp_pprf, pprf)
+            except BaseException:
+                try:
+                    os.remove(tmp_pprf)
+                except OSError:
+                    pass
+                raise
+            try:
+                if etag:
+                    with open(pprf + '.etag', 'w') as f:
+                        f.write(etag + '\n')
+                else:
+                    os.remove(pprf + '.etag')
+            except OSError:
+                pass
+            # (The raw file is now newer than the cache file.)
+            pprf_age = int(os.path.getmtime(pprf))
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                logger.info ('%s has not been modified at RIPE, so not downloading it again.\n' % pprf)
+                # Touch the raw file, so it is not checked again until it is
+                # past its max age once more.  (pprf_age is left as it was,
+                # as the raw file has not changed.)
+                try:
+                    os.utime(pprf)
+                except OSError as e:
+                    logger.warning('Cannot update the mtime of %s (%s)\n' % (pprf, e))
+            else:
+                logger.critical('Cannot fetch %s (HTTP status %i) -- continuing without updating %s \n' %
+                                (ppurl, e.code, pprf))
+                return(2, all_probes_dict)
+        except (OSError, ValueError) as e:
+            logger.critical('Cannot fetch %s (%s) -- continuing without updating %s \n' %
+             (ppurl, e, pprf))
+            return(2, all_probes_dict)
+
+    # If the raw file is newer than the local cache file, decompress
     # and read it in on top of the probe properties cache dictionary.
     if ppcf_age < pprf_age:
+        # The raw file's probe info is a python list (in 'objects'), but a
+        # dictionary keyed on the probe id would be much more efficient, so
+        # we stream the probes out of that list one at a time and index them
+        # as we go, rather than decompressing and parsing the whole file into
+        # memory first.
+        logger.info ('Reading the RIPE Atlas probe data into a dictionary and indexing it...\n')
         try:
-            all_probes_list = json.loads(bz2.BZ2File(pprf).read().decode()).get('objects')
-        except:
-            logger.critical ('Cannot read raw probe data from file: %s\n' % pprf)
-            return(1)
-            # What we end up with in all_probes_list is a python list, but a
-            # dictionary would be much more efficient keyed on the probe id would
-            # be much more efficient, so we're going to burn some electricity and
-            # convert the list into a dictionary.
-        logger.info ('Converting the RIPE Atlas probe data into a dictionary and indexing it...\n')
-        while len(all_probes_list) > 0:
-            probe_info = all_probes_list.pop()
-            probe_id = str(probe_info['id'])
-            all_probes_dict[probe_id] = probe_info
-            logger.debug('Seen probe IDs: ')
-            logger.debug(all_probes_dict.keys())
-        # now save that dictionary as a JSON file...
-        logger.info ('Saving the probe data dictionary as a JSON file at %s...\n' % ppcf)
-        with open(ppcf, 'w') as f:
-            json.dump(all_probes_dict, f)
+            # Read the decompressed data in 1 MiB chunks, rather than ijson's
+            # default 64 KiB, to cut down on the number of small reads from
+            # the bz2 decompressor.
+            with bz2.open(pprf, 'rb') as fh:
+                all_probes_dict.update((probe_info['id'], probe_info)
+                                       for probe_info in ijson.items(fh, 'objects.item', use_float=True, buf_size=1 << 20))
+        except (OSError, EOFError, ijson.JSONError, KeyError) as e:
+            logger.critical ('Cannot read raw probe data from file: %s (%s)\n' % (pprf, e))
+            return(1, all_probes_dict)
+        # now save that dictionary as a pickle file...
+        logger.info ('Saving the probe data dictionary as a pickle file at %s...\n' % probe_properties_pickle_file(ppcf))
+        write_probe_properties_cache_file(ppcf, all_probes_dict)
     logger.info('%s does not need to be updated.\n' % pprf)
-    return(0)
+    return(0, all_probes_dict)
 #
 # END def check_update_probe_properties_cache_file
 #
@@ -889,52 +1343,72 @@ def check_update_probe_properties_cache_file(pprf, ppcf, ppurl):
 # (p_probe_properties[prb_id)) END def report_probe_properties
 ####################
 #
+# Request the properties of one probe from the RIPE Atlas API.  Returns
+# None if the probe info cannot be fetched.
+def fetch_probe_properties(probe_id):
+    from ripe.atlas.cousteau import Probe
+    try:
+        ripe_result = Probe(id=probe_id)
+        return {'asn_v4': ripe_result.asn_v4,
+                'asn_v6': ripe_result.asn_v6,
+                'country_code': ripe_result.country_code,
+                'lat':  ripe_result.geometry['coordinates'][1],
+                'lon':  ripe_result.geometry['coordinates'][0],
+                'address_v4':  ripe_result.address_v4,
+                'address_v6':  ripe_result.address_v6}
+    except Exception as e:
+        logger.debug('Cannot fetch info about probe ID %s from RIPE Atlas API: %s', probe_id, e)
+        return None
+####################
+#
 # Load the probe properties, either from the cache or by requesting them from RIPE.
-def load_probe_properties(probe_ids, ppcf):
+# If the caller already has the cache dictionary in memory (from
+# check_update_probe_properties_cache_file), it can pass it in as
+# all_probes_dict, and we skip reading the cache file back in.
+def load_probe_properties(probe_ids, ppcf, all_probes_dict=None):
     probe_cache_hits = 0
     probe_cache_misses = 0
     matched_probe_info = {}
-    all_probes_dict = {}
     #
-    logger.info ('Reading the probe data dictionary as a JSON file from %s...\n' % ppcf)
-    while True:
+    if all_probes_dict is None:
+        logger.info ('Reading the probe data dictionary from the pickle file %s...\n' % probe_properties_pickle_file(ppcf))
         try:
-            with open(ppcf, 'r') as f:
-                all_probes_dict = json.load(f)
-        except:
-            logger.critical ('Cannot read probe data from file: %s\n' % ppcf)
+            all_probes_dict = read_probe_properties_cache_file(ppcf)[0]
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError) as e:
+            logger.critical ('Cannot read probe data from file: %s (%s)\n' % (ppcf, e))
             logger.critical ('Regenerating probe data to file: %s\n' % ppcf)
-            _res = check_update_probe_properties_cache_file(config['ripe_atlas_probe_properties_raw_file'],
-                                                         config['ripe_atlas_probe_properties_json_cache_file'],
-                                                         config['ripe_atlas_current_probe_properties_url'])
+            _res, all_probes_dict = check_update_probe_properties_cache_file(config['ripe_atlas_probe_properties_raw_file'],
+                                                                             config['ripe_atlas_probe_properties_json_cache_file'],
+                                                                             config['ripe_atlas_current_probe_properties_url'])
             if _res != 0:
                  logger.critical('Unexpected result when updating local cache files: %s' % _res)
-            continue
-        break
     # Loop through the list of supplied (seen) probe ids and collect their
     # info/meta data from either our local file or the RIPE Atlas API
     logger.info ('Matching seen probes with probe data; will query RIPE Atlas API for probe info not in local cache...\n')
-    # Using python set() data strucure instead of checking ccahe hits or misses
-    # python set() element is unique and using set theory, we can identify the differences
-    # and discover new element not found in the caches. This reduce computational complexity
-    dns_probes = set(str(x) for x in probe_ids)
-    all_probes = set(all_probes_dict.keys())
-    new_probes = dns_probes.difference(all_probes)
-    for i in (dns_probes - new_probes):
-        matched_probe_info[i] = all_probes_dict[i] 
-    for p in new_probes:
-        try:
-            ripe_result = Probe(id=p)
-            matched_probe_info[p] = {'asn_v4': ripe_result.asn_v4,
-                                      'asn_v6': ripe_result.asn_v6,
-                                      'country_code': ripe_result.country_code,
-                                      'lat':  ripe_result.geometry['coordinates'][1],
-                                      'lon':  ripe_result.geometry['coordinates'][0],
-                                      'address_v4':  ripe_result.address_v4,
-                                      'address_v6':  ripe_result.address_v6}
-            all_probes_dict[p] = matched_probe_info[p]
-            logger.debug('Probe %9s info fetched from RIPE' % p)
-        except:
+    # Look each (unique) probe id up directly in the cache dictionary,
+    # rather than building a set of all of the (many) cached probe ids, and
+    # collect the ones not found in the cache.
+    new_probes = []
+    for p in set(probe_ids):
+        probe_info = all_probes_dict.get(p)
+        if probe_info is not None:
+            matched_probe_info[p] = probe_info
+            probe_cache_hits += 1
+        else:
+            new_probes.append(p)
+            probe_cache_misses += 1
+    # Each probe not in the cache is a separate (slow) RIPE Atlas API
+    # request, so make those requests concurrently.
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        fetched_probe_info = dict(zip(new_probes, executor.map(fetch_probe_properties, new_probes)))
+    probe_cache_updated = False
+    for p, probe_info in fetched_probe_info.items():
+        if probe_info is not None:
+            matched_probe_info[p] = probe_info
+            all_probes_dict[p] = probe_info
+            probe_cache_updated = True
+            logger.debug('Probe %9s info fetched from RIPE', p)
+        else:
             # Otherwise, it's empty
             # we did not find any information about the probe, so set values to '-'
             matched_probe_info[p] = { 'asn_v4': '-',
@@ -944,12 +1418,12 @@ def load_probe_properties(probe_ids, ppcf):
                                       'lon':  '-',
                                       'address_v4': '-',
                                       'address_v6': '-' }
-            logger.debug('Failed to get info about probe ID %s in the local cache or from RIPE Atlas API.' % p)
+            logger.debug('Failed to get info about probe ID %s in the local cache or from RIPE Atlas API.', p)
     logger.info('cache hits: %i   cache misses: %i.\n' % (probe_cache_hits, probe_cache_misses))
-    # Write out the local JSON cache file
-    if len(new_probes) != 0:
-        with open(ppcf, mode='w') as f:
-            json.dump(all_probes_dict, f)
+    # Write out the local cache file, but only if we added anything to it.
+    # (Misses RIPE had no info for don't count.)
+    if probe_cache_updated:
+        write_probe_properties_cache_file(ppcf, all_probes_dict)
     return(matched_probe_info)
 ####################
 #
@@ -995,25 +1469,26 @@ def check_freshness(timestamp,staleness):
 #
 # Data loading and summary stats reporting loop ...
 
+# (args.probes is the default empty list, not a string, if no probes were given.)
 try:
-    probes = args[0].probes.split(',')
-except:
+    probes = args.probes.split(',')
+except AttributeError:
     probes = []
 
-if args[0].scrape:
-    staleness = args[0].scrape_staleness_seconds
-    m, dnsresult = process_request(data_sources[results_set_id], results_set_id, unixtimes[results_set_id], probes)
-    p_probe_properties = load_probe_properties([dnsresult[x]['prb_id'] for x in range(len(dnsresult))], config['ripe_atlas_probe_properties_json_cache_file'])
+if args.scrape:
+    staleness = args.scrape_staleness_seconds
+    m, dnsresult = process_request(data_sources[results_set_id], results_set_id, unixtimes[results_set_id], probes, keep_results=True)
+    p_probe_properties = load_probe_properties([dnsprobe['prb_id'] for dnsprobe in dnsresult], config['ripe_atlas_probe_properties_json_cache_file'])
     print ('''# HELP ripe_atlas_latency The number of milliseconds for response reported by this probe for the time period requested on this measurement
 # TYPE ripe_atlas_latency gauge ''')
     for dnsprobe in dnsresult:
         try:
-            probe_num = str(dnsprobe['prb_id'])
+            probe_num = dnsprobe['prb_id']
             delay = dnsprobe['result']['rt']
             timestamp = check_freshness(dnsprobe['timestamp'],staleness)
             if timestamp != None:
                 ripe_atlas_latency = { 'measurement_id' : str(dnsprobe['msm_id']),
-                                       'probe_id' : str(dnsprobe['prb_id']),
+                                       'probe_id' : str(probe_num),
                                        'version' : str(dnsprobe['af']),
                                        'target_ip' : str(dnsprobe['dst_addr']),
                                        'probe_asn_v4' : str(p_probe_properties[probe_num]['asn_v4']),
@@ -1024,7 +1499,7 @@ if args[0].scrape:
                                        'probe_lat' : str(p_probe_properties[probe_num]['latitude']),
                                        'probe_lon' : str(p_probe_properties[probe_num]['longitude']),
                                        }
-                method = args[0].id_servermethod
+                method = args.id_servermethod
                 if method == 'quad9':
                      nsid = decode_base64(base64.b64decode(str(dnsprobe['result']['abuf'])))
                      ripe_atlas_latency['sample_reported_pop'] = sanitize_string(str(nsid.split('.')[1]))
@@ -1040,53 +1515,101 @@ if args[0].scrape:
                         ripe_atlas_latency['sample_reported_pop'] = "unknown"
                         ripe_atlas_latency['sample_reported_host'] = "unknown"
                 labels = dict_string(ripe_atlas_latency)
-                if (args[0].include_probe_timestamp) or (args[0].datetime1 != None) :
+                if (args.include_probe_timestamp) or (args.datetime1 != None) :
                     print (f'ripe_atlas_latency{{{labels}}} {delay} {timestamp}')
                 else:
                     print (f'ripe_atlas_latency{{{labels}}} {delay}')
             else:
                 logger.info('Skipping probe %s - sample is %i seconds old' % (probe_num,int(time.time() - dnsprobe['timestamp'])))
-        except:
+        except Exception:
             pass
     exit()
     
-while results_set_id <= last_results_set_id:
-#for t in data_sources:
+# Fetch and process both data sources at the same time: each fetch from
+# RIPE Atlas spends most of its time waiting on the network, and parsing
+# the results (in DnsResult) is CPU bound, so each results set gets a
+# process of its own.  (Forked, rather than spawned, as this script has
+# no __main__ guard to keep a spawned process from running all of it
+# again.  Only on Linux, though: macOS can't safely fork a process that
+# has already used its system frameworks, e.g. for DNS lookups or TLS.)
+# Elsewhere (or where there is only one CPU to run the processes on), the
+# results are only fetched in parallel, in threads, and processed one
+# after the other here.  (Any sys.exit() in another process
+# or thread is only re-raised, by result(), when the loop below gets to
+# that results set, so the sets before it are still reported first, just
+# as when they are all fetched and processed one after the other.)  If
+# both data sources are the same, they are left to process_request() to
+# fetch one after the other, so the second fetch can come out of the RIPE
+# Atlas results cache.
+processed_results = [None] * (last_results_set_id + 1)
+fetched_results = [None] * (last_results_set_id + 1)
+if len(set(zip(data_sources[:last_results_set_id + 1], unixtimes))) > 1:
+    if sys.platform.startswith('linux') and (os.cpu_count() or 1) > 1:
+        # Look up the info for the measurement IDs here, so both processes
+        # start with it in their measurement_info_cache, instead of both
+        # asking the RIPE Atlas API for it.  (If that fails, it's left to the
+        # process for that results set to fail, and report it, in turn.)
+        for data_source in data_sources[:last_results_set_id + 1]:
+            if not os.path.isfile(data_source) and is_measurement_id(data_source):
+                try:
+                    get_measurement_info(int(data_source))
+                except Exception:
+                    pass
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('fork')) as executor:
+            processed_results = [executor.submit(process_results_set, data_source, results_set_id, unixtime, probes)
+                                 for results_set_id, (data_source, unixtime)
+                                 in enumerate(zip(data_sources[:last_results_set_id + 1], unixtimes))]
+    else:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            fetched_results = [executor.submit(fetch_results, data_source, unixtime, probes)
+                               for data_source, unixtime in zip(data_sources[:last_results_set_id + 1], unixtimes)]
+
+for results_set_id, (data_source, unixtime, fetched, processed) in enumerate(zip(data_sources[:last_results_set_id + 1], unixtimes,
+                                                                                  fetched_results, processed_results)):
     # m will receive the measurement ID for the processed data source
-    logger.debug('data_source: %s  results_set_id: %i  unixtime: %i\n' % (data_sources[results_set_id], results_set_id, unixtimes[results_set_id]))
-    m, r = process_request(data_sources[results_set_id], results_set_id, unixtimes[results_set_id], probes)
+    logger.debug('data_source: %s  results_set_id: %i  unixtime: %i\n', data_source, results_set_id, unixtime)
+    if processed is not None:
+        m, results_set_values = processed.result()
+        for d, v in zip(results_set_dicts, results_set_values):
+            d[results_set_id] = v
+    else:
+        if fetched is not None:
+            fetched = fetched.result()
+        m = process_request(data_source, results_set_id, unixtime, probes, fetched=fetched)[0]
     measurement_ids.append(m)
     ######
     # Summary stats
-    if args[0].print_summary_stats:
-        # generate some summary stats
-        m_response_time_average[results_set_id] = statistics.fmean(m_response_times[results_set_id])
-        m_response_time_std_dev[results_set_id] = statistics.pstdev(m_response_times[results_set_id])
-        print()
-        print('%37s %10i' % ('Result set:', results_set_id))
-        print('%37s %10i' % ('Measurement_ID:', m))
-        print('%37s %10i' % ('Total Responses:', m_total_responses[results_set_id]))
-        if args[0].list_slow_probes_only:
-            slow_string = 'Slow (>' + str(args[0].slow_threshold) + 'ms) responses:'
-            print('%37s %10i' % (slow_string, m_total_slow[results_set_id]))
-            print('%37s %10i' % ('Errors:', m_total_errors[results_set_id]))
-            print('%37s %10i' % ('Malformed Responses:', m_total_malformeds[results_set_id]))
-            print('%37s %10i' % ('Malformed Answer Buffers:', m_total_abuf_malformeds[results_set_id]))
-            print('%37s %19s - %19s' % ('Measurements created time range:',
-                    time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(m_timestamps[results_set_id][0])),
-                    time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(m_timestamps[results_set_id][-1]))))
-            print('%37s %4.3f/%4.3f/%4.3f/%4.3f' % ('reponse time (ms) min/avg/max/stddev:',
-                                                m_response_times[results_set_id][0],
-                                                m_response_time_average[results_set_id],
-                                                m_response_times[results_set_id][-1],
-                                                m_response_time_std_dev[results_set_id]))
+    if args.print_summary_stats:
+        # generate some summary stats.  The average comes from the total
+        # that process_request() already added up, so the (population)
+        # standard deviation only needs one more pass over the response times.
+        _response_times = m_response_times[results_set_id]
+        _average = m_total_response_time[results_set_id] / len(_response_times)
+        m_response_time_average[results_set_id] = _average
+        m_response_time_std_dev[results_set_id] = math.sqrt(math.fsum((rt - _average) ** 2 for rt in _response_times) / len(_response_times))
+        # (Build up this set's summary, and write it out in one go.)
+        summary_stats = ('\n'
+                         '%37s %10i\n' % ('Result set:', results_set_id) +
+                         '%37s %10i\n' % ('Measurement_ID:', m) +
+                         '%37s %10i\n' % ('Total Responses:', m_total_responses[results_set_id]))
+        if args.list_slow_probes_only:
+            slow_string = 'Slow (>' + str(args.slow_threshold) + 'ms) responses:'
+            _timestamps = m_timestamps[results_set_id]
+            summary_stats += ('%37s %10i\n' % (slow_string, m_total_slow[results_set_id]) +
+                              '%37s %10i\n' % ('Errors:', m_total_errors[results_set_id]) +
+                              '%37s %10i\n' % ('Malformed Responses:', m_total_malformeds[results_set_id]) +
+                              '%37s %10i\n' % ('Malformed Answer Buffers:', m_total_abuf_malformeds[results_set_id]) +
+                              '%37s %19s - %19s\n' % ('Measurements created time range:',
+                                  time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(min(_timestamps))),
+                                  time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(max(_timestamps)))) +
+                              '%37s %4.3f/%4.3f/%4.3f/%4.3f\n' % ('reponse time (ms) min/avg/max/stddev:',
+                                                                 min(_response_times),
+                                                                 m_response_time_average[results_set_id],
+                                                                 max(_response_times),
+                                                                 m_response_time_std_dev[results_set_id]))
+        sys.stdout.write(summary_stats)
     # End of Summary stats printing
     ######
-    # Build a unique set of probes that responded per set
-    # as many as 2x duplicates).
-    m_seen_probe_ids_set[results_set_id] = set(m_seen_probe_ids[results_set_id])
-    #
-    results_set_id += 1
 # end of Data loading and summary stats reporting loop
 ########################################
 
@@ -1097,21 +1620,24 @@ while results_set_id <= last_results_set_id:
 report_ip_version = 4
 if last_results_set_id > 0:
     logger.debug('Seen probe IDs set 0: ')
-    logger.debug(m_seen_probe_ids_set[0])
+    logger.debug(m_seen_probe_ids[0])
     logger.debug('\nSeen probe IDs set 1: ')
-    logger.debug(m_seen_probe_ids_set[1])
-    if m_seen_probe_ids_set[0].isdisjoint(m_seen_probe_ids_set[1]):
+    logger.debug(m_seen_probe_ids[1])
+    # Intersect the two sets just once; if that comes up empty, they are disjoint.
+    common_probe_ids_set = m_seen_probe_ids[0] & m_seen_probe_ids[1]
+    if not common_probe_ids_set:
         logger.critical('The two sets of measurement results do not have any probes in common.')
         logger.critical('Set 0: ')
-        logger.critical(m_seen_probe_ids_set[0])
+        logger.critical(m_seen_probe_ids[0])
         logger.critical('\nSet 1: ')
-        logger.critical(m_seen_probe_ids_set[1])
+        logger.critical(m_seen_probe_ids[1])
         exit(14)
     # if there are probes in common, build a uniq set of all probe ids
-    # seen in both sets of measurements, and a list of common probe IDs
+    # seen in both sets of measurements, and a set of common probe IDs
+    # (Only the one that gets listed is turned into a (sorted) list, below.)
     else:
-        common_probe_ids = list(m_seen_probe_ids_set[0].intersection(m_seen_probe_ids_set[1]))
-        uniq_seen_probe_ids = list(m_seen_probe_ids_set[0].union(m_seen_probe_ids_set[1]))
+        common_probe_ids = common_probe_ids_set
+        uniq_seen_probe_ids = m_seen_probe_ids[0] | m_seen_probe_ids[1]
 
     # Measurement are requested for or a version of IP (v4 or v6).  As
     # this script can compare two measurements, it's possible that the
@@ -1129,7 +1655,7 @@ if last_results_set_id > 0:
 
 # Only one set of results, so use its uniq set of the seen probe IDs.
 else:
-    uniq_seen_probe_ids = list(m_seen_probe_ids_set[0])
+    uniq_seen_probe_ids = m_seen_probe_ids[0]
     common_probe_ids = uniq_seen_probe_ids
 
 ##################################################
@@ -1138,27 +1664,29 @@ else:
 #
 # If we are printing out detailed (per-probe) stats, we do what's below...
 # By default, we list each probe's properties.
-if not args[0].do_not_list_probes:
+if not args.do_not_list_probes:
     # figure out which probes they want to see... intersection or union?
-    if args[0].all_probes:
-        probe_ids_to_list = uniq_seen_probe_ids
+    # They are listed in the same order as their string representations sort.
+    if args.all_probes:
+        probe_ids_to_list = sorted(uniq_seen_probe_ids, key=str)
     else:
-        probe_ids_to_list = common_probe_ids
+        probe_ids_to_list = sorted(common_probe_ids, key=str)
     # Check (and maybe update) the local probes' properties cache file.
-    _res = check_update_probe_properties_cache_file(config['ripe_atlas_probe_properties_raw_file'],
-                                                     config['ripe_atlas_probe_properties_json_cache_file'],
-                                                     config['ripe_atlas_current_probe_properties_url'])
+    _res, all_probes_dict = check_update_probe_properties_cache_file(config['ripe_atlas_probe_properties_raw_file'],
+                                                                     config['ripe_atlas_probe_properties_json_cache_file'],
+                                                                     config['ripe_atlas_current_probe_properties_url'])
     if _res != 0:
         logger.critical('Unexpected result when updating local cache files: %s' % _res)
     p_probe_properties = load_probe_properties(probe_ids_to_list,
-                                       config['ripe_atlas_probe_properties_json_cache_file'])
+                                       config['ripe_atlas_probe_properties_json_cache_file'],
+                                       all_probes_dict)
     header_label = [None, None]
     # Set the header labels based on what we're comparing (msm_ids or dates)
     #  If there are two dates, we want those as the header labels
-    if args[0].datetime2 != None:
+    if args.datetime2 != None:
         logger.debug('hasattr datetime2')
-        header_label[0] = str(args[0].datetime1) + '(ms)'
-        header_label[1] = str(args[0].datetime2) + '(ms)'
+        header_label[0] = str(args.datetime1) + '(ms)'
+        header_label[1] = str(args.datetime2) + '(ms)'
     #  Otherwise, if there are two msm_ids, we want those as the header labels
     elif len(measurement_ids) == 2:
         header_label[0] = str(measurement_ids[0]) + '(ms)'
@@ -1180,7 +1708,8 @@ if not args[0].do_not_list_probes:
     for pp in probe_properties_to_report:
         fmt_string_a = 'f_' + pp
         if pp == 'probe_id':
-            fmt_string_b = '>12s'
+            # (The probe IDs are integers, which '>12' lines up just like strings.)
+            fmt_string_b = '>12'
             header_words.append(pp)
             header_format.append('{:>12s}')
         elif pp == 'asn':
@@ -1232,134 +1761,169 @@ if not args[0].do_not_list_probes:
     probe_detail_line_format_string += '{f_fmt_clear:s}'
     #
     # Print the header lines, unless the were supressed by the user.
-    if not args[0].no_header:
-        header_string = ''
-        for align, text in zip(header_format, header_words):
-            header_string += (align.format(text) + ' ')
+    if not args.no_header:
+        header_string = ''.join(align.format(text) + ' ' for align, text in zip(header_format, header_words))
         sys.stderr.write(header_string + '\n')
         sys.stderr.write('-' * len(header_string) + '\n')
-    # Iterate over the list of probe ids to list, then print out the
-    # results per result set.
-    probe_ids_to_list.sort()
-    logger.debug('Probes to list: ' + str(probe_ids_to_list))
-    logger.debug('Probes detail line format string: ' + probe_detail_line_format_string)
-    for probe_id in probe_ids_to_list:
+    # Iterate over the (sorted) list of probe ids to list, then print out
+    # the results per result set.
+    logger.debug('Probes to list: %s', probe_ids_to_list)
+    logger.debug('Probes detail line format string: %s', probe_detail_line_format_string)
+    # Pull the per-probe results of the first and (if there is one)
+    # second results set out into lists that line up with
+    # probe_ids_to_list, so each probe's results are a simple walk down the
+    # lists below.  Probes missing from a set get a response time of -1 and
+    # a DNS response of 'unknown'.
+    pm_response_time_a = pm_response_time[0]
+    pm_response_time_b = pm_response_time.get(1, {})
+    pm_dns_server_substring_a = pm_dns_server_substring[0]
+    pm_dns_server_substring_b = pm_dns_server_substring.get(1, {})
+    rts_a = [float(pm_response_time_a.get(p, -1)) for p in probe_ids_to_list]
+    rts_b = [float(pm_response_time_b.get(p, -1)) for p in probe_ids_to_list]
+    sites_a = [pm_dns_server_substring_a.get(p, 'unknown') for p in probe_ids_to_list]
+    sites_b = [pm_dns_server_substring_b.get(p, 'unknown') for p in probe_ids_to_list]
+    # The response time differences (zero unless the probe responded in both sets)
+    rt_diffs = [rt_b - rt_a if rt_a > 0 and rt_b > 0 else 0 for rt_a, rt_b in zip(rts_a, rts_b)]
+    # The options and formatting used to classify and format each probe's
+    # results don't change from probe to probe, so look them up (and build
+    # them) once.
+    latency_diff_threshold = args.latency_diff_threshold
+    emphasis_chars = args.emphasis_chars
+    slow_threshold = args.slow_threshold
+    list_slow_probes_only = args.list_slow_probes_only
+    # Which formatting each kind of result gets: slow sites are yellow,
+    # non-responding sites (we set to -1) get magenta, and so on.  With
+    # no_color, they all get nothing, so the loop below doesn't have to
+    # check for that.
+    if args.no_color:
+        clear_fmt_chars = ''
+        slow_fmt_chars = ''
+        no_response_fmt_chars = ''
+        rt_diff_slower_fmt_chars = ''
+        rt_diff_faster_fmt_chars = ''
+        rt_diff_zero_fmt_chars = ''
+        sites_differ_fmt_chars = ''
+        sites_unknown_fmt_chars = ''
+        sites_no_reply_fmt_chars = ''
+    else:
+        clear_fmt_chars = fmt.clear
+        slow_fmt_chars = fmt.bright_yellow
+        no_response_fmt_chars = fmt.bright_magenta
+        rt_diff_slower_fmt_chars = fmt.bold_bright_red
+        rt_diff_faster_fmt_chars = fmt.bold_bright_green
+        rt_diff_zero_fmt_chars = fmt.bright_magenta
+        sites_differ_fmt_chars = fmt.bold_bright_red
+        sites_unknown_fmt_chars = fmt.bright_magenta
+        sites_no_reply_fmt_chars = fmt.bright_yellow
+    # Probes can have v4 or v6 ASNs and IP addresses.  By default we show v4, unless BOTH measurements were v6
+    if report_ip_version == 6:
+        display_asn_key = 'asn_v6'
+        display_address_key = 'address_v6'
+    else:
+        display_asn_key = 'asn_v4'
+        display_address_key = 'address_v4'
+    # Collect the per-probe lines, and write them all out in one go at the end.
+    probe_detail_lines = []
+    # The line format is built from the (user-configurable) list of
+    # properties above, so it can't be a fixed f-string, but we can at
+    # least fill in the clear-formatting codes (which are the same on every
+    # line) now, and look up its format method just once.
+    format_probe_detail_line = probe_detail_line_format_string.replace('{f_fmt_clear:s}', clear_fmt_chars).format
+    for probe_num, rt_a, rt_b, rt_diff, site_a, site_b in zip(probe_ids_to_list, rts_a, rts_b, rt_diffs, sites_a, sites_b):
+        # Skip the (fast) probes that won't be listed before doing any
+        # formatting work for them.
+        if list_slow_probes_only and rt_a <= slow_threshold and rt_b <= slow_threshold:
+            continue
+        probe_properties = p_probe_properties[probe_num]
         #
-        # Prepare what will be printed based on result set.
-        # Probes can have v4 or v6 ASNs and IP addresses.  By default we show v4, unless BOTH measurements were v6
-        p_probe_properties[probe_id]['display_asn'] = p_probe_properties[probe_id].get('asn_v4','-')
-        p_probe_properties[probe_id]['display_address'] = p_probe_properties[probe_id].get('address_v4','-')
-        if report_ip_version == 6:
-            p_probe_properties[probe_id]['display_asn'] = p_probe_properties[probe_id].get('asn_v6','-')
-            p_probe_properties[probe_id]['display_address'] = p_probe_properties[probe_id].get('address_v6','-')
-        if p_probe_properties[probe_id]['display_asn'] is None:
-            p_probe_properties[probe_id]['display_asn'] = '-'
-        if p_probe_properties[probe_id]['display_address'] is None:
-            p_probe_properties[probe_id]['display_address'] = '-'
-        if p_probe_properties[probe_id]['country_code'] is None:
-            p_probe_properties[probe_id]['country_code'] = '-'
-        # generate an response_set + probe_id to use as an index into
-        # various dicts with responses
-        results_and_probes_id = str(0) + '-' + str(probe_id)
-        next_results_and_probes_id = str(1) + '-' + str(probe_id)
-        rt_a = float(pm_response_time.setdefault(results_and_probes_id, -1))
-        rt_b = float(pm_response_time.setdefault(next_results_and_probes_id, -1))
-        rt_a_fmt_chars = fmt.clear
-        rt_b_fmt_chars = fmt.clear
-        sites_fmt_chars = fmt.clear
+        # Prepare what will be printed based on result set.  (These are
+        # kept in locals, rather than added to the probe's properties,
+        # which are shared with the probe properties cache.)
+        display_asn = probe_properties.get(display_asn_key, '-')
+        if display_asn is None:
+            display_asn = '-'
+        display_address = probe_properties.get(display_address_key, '-')
+        if display_address is None:
+            display_address = '-'
+        country_code = probe_properties['country_code']
+        if country_code is None:
+            country_code = '-'
         rt_emph_char = ' '
         sites_emph_char = ' '
-        rt_fmt_chars = fmt.clear
-        if rt_a > 0 and rt_b > 0:
-            rt_diff = rt_b - rt_a
-        else:
-            rt_diff = 0
-        if rt_diff > args[0].latency_diff_threshold:
-            rt_diff_fmt_chars = fmt.bold + fmt.bright_red
-            if args[0].emphasis_chars:
+        if rt_diff > latency_diff_threshold:
+            rt_diff_fmt_chars = rt_diff_slower_fmt_chars
+            if emphasis_chars:
                 rt_emph_char = '*'
-        elif rt_diff < (args[0].latency_diff_threshold * -1 ):
-            rt_diff_fmt_chars = fmt.bold + fmt.bright_green
+        elif rt_diff < -latency_diff_threshold:
+            rt_diff_fmt_chars = rt_diff_faster_fmt_chars
         elif rt_diff == 0:
-            rt_diff_fmt_chars = fmt.bright_magenta
+            rt_diff_fmt_chars = rt_diff_zero_fmt_chars
         else:
-            rt_diff_fmt_chars = fmt.clear
-            if args[0].emphasis_chars:
-                rt_emph_char = ' '
-        if pm_dns_server_substring.setdefault(results_and_probes_id, 'unknown') == pm_dns_server_substring.setdefault(next_results_and_probes_id, 'unknown'):
-            sites_string = pm_dns_server_substring[results_and_probes_id]
-            sites_fmt_chars = fmt.clear
-            if args[0].emphasis_chars:
-                sites_emph_char = ' '
+            rt_diff_fmt_chars = clear_fmt_chars
+        if site_a == site_b:
+            sites_string = site_a
         else:
-            sites_string = pm_dns_server_substring[results_and_probes_id] + ':' + pm_dns_server_substring[next_results_and_probes_id]
-            sites_fmt_chars = fmt.bold + fmt.bright_red
-            if args[0].emphasis_chars:
+            sites_string = site_a + ':' + site_b
+            if emphasis_chars:
                 sites_emph_char = '!'
-            # Printing output is complicated.
-        if not args[0].list_slow_probes_only or (args[0].list_slow_probes_only and ((rt_a > args[0].slow_threshold) or (rt_b > args[0].slow_threshold))):
-            # Slow sites are yellow, and non-responding sites (we
-            # set to -1) get magenta
-            if args[0].no_color:
-                rt_a_fmt_chars = ''
-                rt_b_fmt_chars = ''
-                sites_fmt_chars = ''
-                rt_diff_fmt_chars = ''
-                format_clear = ''
-            else:
-                if rt_a > args[0].slow_threshold:
-                    rt_a_fmt_chars = fmt.bright_yellow
-                elif rt_a < 0:
-                    rt_a_fmt_chars = fmt.bright_magenta
-                if rt_b > args[0].slow_threshold:
-                    rt_b_fmt_chars = fmt.bright_yellow
-                elif rt_b < 0:
-                    rt_b_fmt_chars = fmt.bright_magenta
-                # Sites differed between the two tests: highlight RED
-                if re.match(r'.*:.*', sites_string, flags=re.IGNORECASE):
-                    sites_fmt_chars != fmt.bright_red
-                # Sites the same across tests, but both unknown: highlight MAGENTA
-                elif re.match(r'unknown', sites_string, flags=re.IGNORECASE):
-                    sites_fmt_chars = fmt.bright_magenta
-                # Sites the same across tests, but both no_reply: highlight yellow
-                elif re.match(r'no_reply', sites_string, flags=re.IGNORECASE):
-                    sites_fmt_chars = fmt.bright_yellow
-                # should already be clear, but just in case...
-                else:
-                    sites_fmt_chars = fmt.clear
-                format_clear = fmt.clear
-            try:
-                print(probe_detail_line_format_string.format(f_probe_id=probe_id,
-                                                         f_asn=str(p_probe_properties[probe_id]['display_asn']),
-                                                         f_country_code=p_probe_properties[probe_id]['country_code'],
-                                                         f_ip_address=p_probe_properties[probe_id]['display_address'],
-                                                         f_rt_a_fmt_chars=rt_a_fmt_chars,
-                                                         f_rt_a=rt_a,
-                                                         f_rt_b_fmt_chars=rt_b_fmt_chars,
-                                                         f_rt_b=rt_b,
-                                                         f_rt_diff_fmt_chars=rt_diff_fmt_chars,
-                                                         f_rt_diff=rt_diff,
-                                                         f_rt_emph_char=rt_emph_char,
-                                                         f_sites_fmt_chars=sites_fmt_chars,
-                                                         f_dns_response=sites_string,
-                                                         f_sites_emph_char=sites_emph_char,
-                                                         f_fmt_clear=format_clear))
-            except:
-                logger.debug("There is something unexpected in this probe info: ")
-                for a in (probe_id,
-                          str(p_probe_properties[probe_id]['display_asn']),
-                          p_probe_properties[probe_id]['country_code'],
-                          p_probe_properties[probe_id]['display_address'],
-                          rt_a_fmt_chars,
-                          rt_a,
-                          rt_b_fmt_chars,
-                          rt_b,
-                          rt_diff_fmt_chars,
-                          rt_diff,
-                          rt_emph_char,
-                          sites_fmt_chars,
-                          sites_string,
-                          sites_emph_char,
-                          format_clear):
-                    logger.debug(' ' + str(a))
-
+        # Printing output is complicated.
+        if rt_a > slow_threshold:
+            rt_a_fmt_chars = slow_fmt_chars
+        elif rt_a < 0:
+            rt_a_fmt_chars = no_response_fmt_chars
+        else:
+            rt_a_fmt_chars = clear_fmt_chars
+        if rt_b > slow_threshold:
+            rt_b_fmt_chars = slow_fmt_chars
+        elif rt_b < 0:
+            rt_b_fmt_chars = no_response_fmt_chars
+        else:
+            rt_b_fmt_chars = clear_fmt_chars
+        # (Plain string tests, rather than regexes, are plenty
+        # for these.)
+        # Sites differed between the two tests: highlight RED
+        if ':' in sites_string:
+            sites_fmt_chars = sites_differ_fmt_chars
+        # Sites the same across tests, but both unknown: highlight MAGENTA
+        elif sites_string[:7].lower() == 'unknown':
+            sites_fmt_chars = sites_unknown_fmt_chars
+        # Sites the same across tests, but both no_reply: highlight yellow
+        elif sites_string[:8].lower() == 'no_reply':
+            sites_fmt_chars = sites_no_reply_fmt_chars
+        else:
+            sites_fmt_chars = clear_fmt_chars
+        try:
+            probe_detail_lines.append(format_probe_detail_line(f_probe_id=probe_num,
+                                                               f_asn=str(display_asn),
+                                                               f_country_code=country_code,
+                                                               f_ip_address=display_address,
+                                                               f_rt_a_fmt_chars=rt_a_fmt_chars,
+                                                               f_rt_a=rt_a,
+                                                               f_rt_b_fmt_chars=rt_b_fmt_chars,
+                                                               f_rt_b=rt_b,
+                                                               f_rt_diff_fmt_chars=rt_diff_fmt_chars,
+                                                               f_rt_diff=rt_diff,
+                                                               f_rt_emph_char=rt_emph_char,
+                                                               f_sites_fmt_chars=sites_fmt_chars,
+                                                               f_dns_response=sites_string,
+                                                               f_sites_emph_char=sites_emph_char))
+        except Exception:
+            logger.debug("There is something unexpected in this probe info: ")
+            for a in (probe_num,
+                      str(display_asn),
+                      country_code,
+                      display_address,
+                      rt_a_fmt_chars,
+                      rt_a,
+                      rt_b_fmt_chars,
+                      rt_b,
+                      rt_diff_fmt_chars,
+                      rt_diff,
+                      rt_emph_char,
+                      sites_fmt_chars,
+                      sites_string,
+                      sites_emph_char,
+                      clear_fmt_chars):
+                logger.debug(' %s', a)
+    if probe_detail_lines:
+        sys.stdout.write('\n'.join(probe_detail_lines) + '\n')
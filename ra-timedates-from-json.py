@@ -2,7 +2,10 @@
 
 # print out the "normal" date/times from RIPE Atlas JSON data file
 
-import json
+# ijson streams the timestamps out of the (possibly very large) RIPE
+# Atlas JSON data files one at a time, rather than reading whole files
+# into memory.
+import ijson
 import logging
 import sys
 import time
@@ -13,11 +16,11 @@ import time
 #logging.basicConfig(level=logging.DEBUG)
 
 for f in sys.argv[1:]:
-  json_blob = {}
   print(f)
-  with open(f) as input_file:
+  with open(f, 'rb') as input_file:
   #  for line in input_file:
   #    json_line = json.loads(line)
-    json_blob = json.load(input_file)
-    for result in json_blob:
-      print(time.strftime('%x %X' ,time.gmtime(result['timestamp'])))
+    # (Hand the lines to stdout's buffer as they are made, rather than
+    # making a print() call for each one.)
+    sys.stdout.writelines(time.strftime('%x %X\n' ,time.gmtime(timestamp))
+                          for timestamp in ijson.items(input_file, 'item.timestamp'))